@@ -6,16 +6,21 @@
 # See https://aboutcode.org for more information about nexB OSS projects.
 #
 
+import atexit
 import ctypes
 import contextlib
+import functools
 import io
+import itertools
 import os
 from os import path
 
 import logging
-import signal
+import select
 import subprocess
+import threading
 
+from commoncode.fileutils import delete
 from commoncode.fileutils import get_temp_dir
 from commoncode.system import on_posix
 from commoncode.system import on_windows
@@ -43,6 +48,13 @@ PATH_ENV_VAR = 'PATH'
 LD_LIBRARY_PATH = 'LD_LIBRARY_PATH'
 DYLD_LIBRARY_PATH = 'DYLD_LIBRARY_PATH'
 
+# shell==True is DANGEROUS but we are not running arbitrary commands
+# though we can execute commands that just happen to be in the path
+# See why we need it on Windows https://bugs.python.org/issue8557
+_SHELL = bool(on_windows)
+
+_TRACE_PRINTER = logger.debug if TRACE else print
+
 
 def execute(cmd_loc, args, cwd=None, env=None, to_files=False, log=TRACE):
     """
@@ -58,38 +70,139 @@ def execute(cmd_loc, args, cwd=None, env=None, to_files=False, log=TRACE):
     Run the command using the `cwd` current working directory with an `env` dict
     of environment variables.
     """
+    proc, sop, sep = _start(cmd_loc, args, cwd, env, to_files, log)
+    try:
+        # stdout and stderr are redirected to files: there is nothing to
+        # read back with communicate()
+        rc = proc.wait()
+    finally:
+        close(proc)
+
+    return _get_outputs(rc, sop, sep, to_files)
+
+
+def execute_many(
+    commands,
+    cwd=None,
+    env=None,
+    to_files=False,
+    log=TRACE,
+    max_processes=None,
+):
+    """
+    Run a `commands` list of (cmd_loc, args) tuples in parallel and return a
+    list of (return code, stdout, stderr) tuples in the same order as the
+    `commands`. See execute() for details on the other arguments.
+
+    Run at most `max_processes` processes at once, defaulting to the number of
+    CPUs. On Linux, wait for any of the running processes to exit with a single
+    poll() on their pidfds. Otherwise, wait for each process in turn.
+    """
+    if max_processes is not None and max_processes < 1:
+        raise ValueError(f'max_processes must be at least 1: {max_processes!r}')
+
+    commands = list(commands)
+    max_processes = max_processes or os.cpu_count() or 1
+    results = [None] * len(commands)
+
+    use_pidfd = hasattr(os, 'pidfd_open')
+    poller = select.poll() if use_pidfd else None
+    index_by_pidfd = {}
+    # {index: (proc, stdout, stderr, pidfd)} in start order
+    running = {}
+
+    def finish(index):
+        proc, sop, sep, pidfd = running.pop(index)
+        if pidfd is not None:
+            del index_by_pidfd[pidfd]
+            poller.unregister(pidfd)
+            os.close(pidfd)
+        try:
+            rc = proc.wait()
+        finally:
+            close(proc)
+        results[index] = _get_outputs(rc, sop, sep, to_files)
+
+    def reap():
+        if use_pidfd:
+            for pidfd, _event in poller.poll():
+                finish(index_by_pidfd[pidfd])
+        else:
+            # wait for the oldest running process
+            finish(next(iter(running)))
+
+    try:
+        for index, (cmd_loc, args) in enumerate(commands):
+            while len(running) >= max_processes:
+                reap()
+
+            proc, sop, sep = _start(cmd_loc, args, cwd, env, to_files, log)
+            pidfd = None
+            if use_pidfd:
+                try:
+                    pidfd = os.pidfd_open(proc.pid)
+                    poller.register(pidfd, select.POLLIN)
+                    index_by_pidfd[pidfd] = index
+                except OSError:
+                    # pidfd are not supported by this kernel
+                    use_pidfd = False
+                    if pidfd is not None:
+                        os.close(pidfd)
+                        pidfd = None
+            running[index] = proc, sop, sep, pidfd
+
+        while running:
+            reap()
+
+    finally:
+        for proc, _sop, _sep, pidfd in running.values():
+            if pidfd is not None:
+                os.close(pidfd)
+            close(proc)
+
+    return results
+
+
+def _start(cmd_loc, args, cwd, env, to_files, log):
+    """
+    Start a `cmd_loc` command with the `args` arguments list and return a tuple
+    of (Popen process, stdout location, stderr location). See execute() for
+    details on the other arguments.
+    """
     assert cmd_loc
-    full_cmd = [cmd_loc] + (args or [])
+    full_cmd = (cmd_loc, *args) if args else (cmd_loc,)
 
     # any shared object should be either in the PATH, the rpath or
     # side-by-side with the exceutable
     cmd_dir = os.path.dirname(cmd_loc)
-    env = get_env(env, lib_dir=cmd_dir) or None
+    env = get_env(env, lib_dir=cmd_dir)
     cwd = cwd or curr_dir
 
     # temp files for stderr and stdout
-    tmp_dir = get_temp_dir(prefix='cmd-')
-
-    sop = path.join(tmp_dir, 'stdout')
-    sep = path.join(tmp_dir, 'stderr')
+    sop, sep = _get_output_locations(to_files)
 
-    # shell==True is DANGEROUS but we are not running arbitrary commands
-    # though we can execute commands that just happen to be in the path
-    # See why we need it on Windows https://bugs.python.org/issue8557
-    shell = True if on_windows else False
+    shell = _SHELL
 
     if log:
-        printer = logger.debug if TRACE else lambda x: print(x)
-        printer(
+        _TRACE_PRINTER(
             'Executing command %(cmd_loc)r as:\n%(full_cmd)r\nwith: env=%(env)r\n'
             'shell=%(shell)r\ncwd=%(cwd)r\nstdout=%(sop)r\nstderr=%(sep)r'
             % locals())
 
-    proc = None
-    rc = 100
-
+    # pass raw file descriptors to the child process: there is no need for
+    # Python file objects as we never write to these files from here. These
+    # are duplicated in the child process and can be closed once started.
+    # NB: the child process writes directly to these files and no output data
+    # goes through this process: do not use pipes here, even with splice().
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    stdout = os.open(sop, flags, 0o600)
     try:
-        with io.open(sop, 'wb') as stdout, io.open(sep, 'wb') as stderr, pushd(cmd_dir):
+        stderr = os.open(sep, flags, 0o600)
+        try:
+            # NB: do not add a preexec_fn, user, group or extra_groups
+            # argument here: any of these disable the fast vfork() code path
+            # that CPython uses on Linux to spawn processes and would slow
+            # down every command execution.
             proc = subprocess.Popen(
                 full_cmd,
                 cwd=cwd,
@@ -97,28 +210,92 @@ def execute(cmd_loc, args, cwd=None, env=None, to_files=False, log=TRACE):
                 stdout=stdout,
                 stderr=stderr,
                 shell=shell,
+                close_fds=True,
                 # -1 defaults bufsize to system bufsize
                 bufsize=-1,
-                universal_newlines=True,
             )
-            stdout, stderr = proc.communicate()
-            rc = proc.returncode if proc else 0
+        finally:
+            os.close(stderr)
     finally:
-        close(proc)
+        os.close(stdout)
 
+    return proc, sop, sep
+
+
+def _get_outputs(rc, sop, sep, to_files):
+    """
+    Return a tuple of (`rc` return code, stdout, stderr) for a completed command
+    given its `sop` stdout and `sep` stderr file locations. See execute() for
+    details on `to_files`.
+    """
     if not to_files:
         # return output as ASCII string loaded from the output files
-        with open(sop, 'rb') as so:
-            sor = so.read()
-            sop = text.toascii(sor).strip()
-
-        with open(sep, 'rb') as se:
-            ser = se.read()
-            sep = text.toascii(ser).strip()
+        so_loc, se_loc = sop, sep
+        sop = text.toascii(_slurp(so_loc)).strip()
+        sep = text.toascii(_slurp(se_loc)).strip()
+        delete(so_loc)
+        delete(se_loc)
 
     return rc, sop, sep
 
 
+# per-process temp directory for command outputs that are deleted once read
+_pool_dir = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_counter = itertools.count()
+
+
+def _get_output_locations(to_files=False):
+    """
+    Return a tuple of new unique (stdout, stderr) temporary file locations for
+    a command execution.
+
+    If `to_files` is True, these files are returned to the caller and created
+    in a new temp directory. Otherwise, these files are deleted once read and
+    are created in a temp directory created once per process and deleted at
+    exit rather than in a new temp directory for each command execution.
+    """
+    if to_files:
+        tmp_dir = get_temp_dir(prefix='cmd-')
+        return path.join(tmp_dir, 'stdout'), path.join(tmp_dir, 'stderr')
+
+    global _pool_dir
+    global _pool_pid
+
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool_pid != pid or not path.isdir(_pool_dir):
+            # either first use, a forked process that should not share the
+            # parent process directory, or the directory was deleted
+            _pool_dir = get_temp_dir(prefix='cmd-pool-')
+            _pool_pid = pid
+        tmp_dir = _pool_dir
+
+    num = next(_pool_counter)
+    return (
+        path.join(tmp_dir, f'stdout.{pid}.{num}'),
+        path.join(tmp_dir, f'stderr.{pid}.{num}'),
+    )
+
+
+@atexit.register
+def _delete_pool_dir():
+    """
+    Delete the output files temp directory if it was created by this process.
+    """
+    if _pool_dir and _pool_pid == os.getpid():
+        delete(_pool_dir)
+
+
+def _slurp(location):
+    """
+    Return the content of the file at `location` as bytes.
+    """
+    with io.open(location, 'rb') as inp:
+        return inp.read()
+
+
 def execute2(
     cmd_loc,
     args,
@@ -160,29 +337,45 @@ def get_env(base_vars=None, lib_dir=None):
     environment variables dictionary as a base if provided. Note: if `base_vars`
     contains DY/LD_LIBRARY_PATH variables these will be overwritten. On POSIX,
     add `lib_dir` as DY/LD_LIBRARY_PATH-like path if provided.
+
+    Return None if there are no `base_vars` and no `lib_dir` to add such that
+    the current environment is inherited as-is. Return the `base_vars` as-is if
+    there is no `lib_dir` to add and no conversion to unicode is needed.
     """
+    add_lib_dir = lib_dir and on_posix
+    if not add_lib_dir:
+        if not base_vars:
+            return None
+        if all(type(k) is str and type(v) is str for k, v in base_vars.items()):
+            return base_vars
+
     env_vars = {}
     if base_vars:
         env_vars.update(base_vars)
 
     # Create and add LD environment variables
-    if lib_dir and on_posix:
+    if add_lib_dir:
         new_path = f'{lib_dir}'
+        environ = os.environ
         # on Linux/posix
-        ld_lib_path = os.environ.get(LD_LIBRARY_PATH)
-        env_vars.update({LD_LIBRARY_PATH: update_path_var(ld_lib_path, new_path)})
+        ld_lib_path = environ.get(LD_LIBRARY_PATH)
+        env_vars[LD_LIBRARY_PATH] = update_path_var(ld_lib_path, new_path)
         # on Mac, though LD_LIBRARY_PATH should work too
-        dyld_lib_path = os.environ.get(DYLD_LIBRARY_PATH)
-        env_vars.update({DYLD_LIBRARY_PATH: update_path_var(dyld_lib_path, new_path)})
+        dyld_lib_path = environ.get(DYLD_LIBRARY_PATH)
+        env_vars[DYLD_LIBRARY_PATH] = update_path_var(dyld_lib_path, new_path)
 
-    env_vars = {text.as_unicode(k): text.as_unicode(v) for k, v in env_vars.items()}
+    if not all(type(k) is str and type(v) is str for k, v in env_vars.items()):
+        env_vars = {text.as_unicode(k): text.as_unicode(v) for k, v in env_vars.items()}
 
     return env_vars
 
 
-def close(proc):
+def close(proc, timeout=0.5):
     """
     Close a `proc` process opened pipes and kill the process.
+
+    Wait up to `timeout` seconds for the process to exit on its own, then send a
+    SIGTERM and wait again, then send a SIGKILL as a last resort.
     """
     if not proc:
         return
@@ -199,21 +392,69 @@ def close(proc):
     close_pipe(getattr(proc, 'stdout', None))
     close_pipe(getattr(proc, 'stderr', None))
 
+    if proc.poll() is not None:
+        # already exited and reaped
+        return
+
     try:
-        # Ensure process death otherwise proc.wait may hang in some cases
-        # NB: this will run only on POSIX OSes supporting signals
-        os.kill(proc.pid, signal.SIGKILL)  # NOQA
-    except:
-        pass
+        if not _wait_pidfd(proc, timeout):
+            proc.terminate()
+            if not _wait_pidfd(proc, timeout):
+                proc.kill()
+    except OSError:
+        try:
+            # Ensure process death otherwise proc.wait may hang in some cases
+            # NB: this sends a SIGKILL on POSIX and calls TerminateProcess()
+            # on Windows
+            proc.kill()
+        except OSError:
+            pass
 
     # This may slow things down a tad on non-POSIX Oses but is safe:
     # this calls os.waitpid() to make sure the process is dead
     proc.wait()
 
 
+def _wait_pidfd(proc, timeout):
+    """
+    Wait up to `timeout` seconds for the `proc` process to exit without polling
+    in a sleep loop. Return True if the process has exited.
+
+    Use a pidfd on Linux and a kqueue on macOS and BSDs. Raise an OSError if
+    neither is available, such as on Windows.
+    """
+    if hasattr(os, 'pidfd_open'):
+        fd = os.pidfd_open(proc.pid)
+        try:
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            return bool(poller.poll(timeout * 1000))
+        finally:
+            os.close(fd)
+
+    if hasattr(select, 'kqueue'):
+        kq = select.kqueue()
+        try:
+            event = select.kevent(
+                proc.pid,
+                filter=select.KQ_FILTER_PROC,
+                flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                fflags=select.KQ_NOTE_EXIT,
+            )
+            return bool(kq.control([event], 1, timeout))
+        finally:
+            kq.close()
+
+    raise OSError('Waiting on a process exit is not supported on this OS.')
+
+
 def load_shared_library(dll_loc, *args):
     """
     Return the loaded shared library object from the ``dll_loc`` location.
+
+    Loaded libraries are cached by real path and the same object is returned on
+    subsequent calls: callers must not dlclose() the returned library handle as
+    it is shared.
     """
     if not dll_loc or not path.exists(dll_loc):
         raise ImportError(f'Shared library does not exists: dll_loc: {dll_loc}')
@@ -221,11 +462,27 @@ def load_shared_library(dll_loc, *args):
     if not isinstance(dll_loc, str):
         dll_loc = os.fsdecode(dll_loc)
 
+    dll_loc = os.path.realpath(dll_loc)
+    dll_dir = os.path.dirname(dll_loc)
+    return _load_cached(dll_loc, dll_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_cached(dll_loc, dll_dir):
+    """
+    Return the loaded shared library object from the ``dll_loc`` real path
+    location loaded from the ``dll_dir`` directory.
+    """
     lib = None
 
-    dll_dir = os.path.dirname(dll_loc)
     try:
-        with pushd(dll_dir):
+        if on_windows:
+            # dependent DLLs are searched in the current directory on Windows
+            with pushd(dll_dir):
+                lib = ctypes.CDLL(dll_loc)
+        else:
+            # dll_loc is absolute and dependent libraries are found through
+            # their RUNPATH and LD_LIBRARY_PATH, not the current directory
             lib = ctypes.CDLL(dll_loc)
     except OSError as e:
         from pprint import pformat
@@ -267,29 +524,23 @@ def update_path_var(existing_path_var, new_path):
     if not new_path:
         return existing_path_var
 
-    existing_path_var = existing_path_var or ''
+    if not isinstance(new_path, str):
+        new_path = os.fsdecode(new_path)
 
-    existing_path_var = os.fsdecode(existing_path_var)
-    new_path = os.fsdecode(new_path)
+    if not existing_path_var:
+        return new_path
 
-    path_elements = existing_path_var.split(os.pathsep)
+    if not isinstance(existing_path_var, str):
+        existing_path_var = os.fsdecode(existing_path_var)
 
-    if not path_elements:
-        updated_path_var = new_path
-
-    elif new_path not in path_elements:
-        # add new path to the front of the PATH env var
-        path_elements.insert(0, new_path)
-        updated_path_var = os.pathsep.join(path_elements)
-
-    else:
+    sep = os.pathsep
+    # frame with separators to match only whole path elements
+    if f'{sep}{new_path}{sep}' in f'{sep}{existing_path_var}{sep}':
         # new path is already in PATH, change nothing
-        updated_path_var = existing_path_var
-
-    if not isinstance(updated_path_var, str):
-        updated_path_var = os.fsdecode(updated_path_var)
+        return existing_path_var
 
-    return updated_path_var
+    # add new path to the front of the PATH env var
+    return f'{new_path}{sep}{existing_path_var}'
 
 
 PATH_VARS = DYLD_LIBRARY_PATH, LD_LIBRARY_PATH, 'PATH',
@@ -105,6 +105,13 @@ def toascii(s, translit=False):
     characters may be deleted.
     Inspired from: http://code.activestate.com/recipes/251871/#c10 by Aaron Bentley.
     """
+    # fast path: pure ASCII input needs no decoding, normalization or
+    # transliteration
+    if s.isascii():
+        if not isinstance(s, str):
+            s = s.decode('ascii')
+        return s.replace('[?]', '_')
+
     if not isinstance(s, str):
         s = as_unicode(s)
     if translit:
@@ -58,6 +58,126 @@ class TestCommand(FileBasedTesting):
         # do not throw exception
         stdout.encode('ascii')
 
+    def test_execute_many(self):
+        python = sys.executable
+        commands = [
+            (python, ['-c', 'import time; time.sleep(0.2); print("foo")']),
+            (python, ['-c', 'print("bar")']),
+            (python, ['-c', 'import sys; sys.exit("baz")']),
+        ]
+        results = command.execute_many(commands, max_processes=2)
+        expected = [
+            (0, 'foo', ''),
+            (0, 'bar', ''),
+            (1, '', 'baz'),
+        ]
+        assert results == expected
+
+    def test_execute_many_with_invalid_max_processes(self):
+        python = sys.executable
+        commands = [(python, ['-c', 'print("foo")'])]
+        with self.assertRaises(ValueError):
+            command.execute_many(commands, max_processes=0)
+        with self.assertRaises(ValueError):
+            command.execute_many(commands, max_processes=-1)
+
+    def test_execute_many_closes_running_processes_on_failure(self):
+        from unittest import mock
+        python = sys.executable
+        commands = [
+            (python, ['-c', 'import time; time.sleep(30)']),
+            (python, ['-c', 'import time; time.sleep(30)']),
+            (python, ['-c', 'print("foo")']),
+        ]
+        start = command._start
+        started = []
+
+        def failing_start(*args, **kwargs):
+            if len(started) == 2:
+                raise OSError('Failed to start')
+            started.append(start(*args, **kwargs))
+            return started[-1]
+
+        with mock.patch.object(command, '_start', side_effect=failing_start):
+            with mock.patch.object(command, 'close', wraps=command.close) as mocked:
+                with self.assertRaises(OSError):
+                    command.execute_many(commands, max_processes=3)
+
+        closed = [call[0][0] for call in mocked.call_args_list]
+        assert closed == [proc for proc, _sop, _sep in started]
+        for proc in closed:
+            assert proc.returncode is not None
+
+    def test_execute_to_files_returns_distinct_output_files(self):
+        python = sys.executable
+        rc1, stdout1, stderr1 = command.execute(
+            python, ['-c', 'print("foo")'], to_files=True
+        )
+        rc2, stdout2, stderr2 = command.execute(
+            python, ['-c', 'print("bar")'], to_files=True
+        )
+        assert rc1 == rc2 == 0
+        assert len({stdout1, stderr1, stdout2, stderr2}) == 4
+        with open(stdout1) as so1, open(stdout2) as so2:
+            assert so1.read().strip() == 'foo'
+            assert so2.read().strip() == 'bar'
+
+    def test_execute_to_files_returns_output_files_in_distinct_directories(self):
+        from commoncode.fileutils import delete
+        python = sys.executable
+        _rc, stdout1, _stderr = command.execute(
+            python, ['-c', 'print("foo")'], to_files=True
+        )
+        _rc, stdout2, stderr2 = command.execute(
+            python, ['-c', 'print("bar")'], to_files=True
+        )
+        assert os.path.dirname(stdout1) != os.path.dirname(stdout2)
+
+        delete(os.path.dirname(stdout1))
+        assert os.path.exists(stdout2)
+        assert os.path.exists(stderr2)
+
+    def test_execute_after_deleting_output_files_directory(self):
+        from commoncode.fileutils import delete
+        python = sys.executable
+        _rc, stdout, _stderr = command.execute(
+            python, ['-c', 'print("foo")'], to_files=True
+        )
+        delete(os.path.dirname(stdout))
+
+        command.execute(python, ['-c', 'print("foo")'])
+        assert os.path.isdir(command._pool_dir)
+        delete(command._pool_dir)
+
+        rc, stdout, stderr = command.execute(python, ['-c', 'print("bar")'])
+        assert rc == 0
+        assert stdout == 'bar'
+        assert stderr == ''
+
+    def test_get_env_converts_bytes_to_unicode(self):
+        env = command.get_env({b'FOO': b'bar', 'BAZ': 'qux'})
+        assert env == {'FOO': 'bar', 'BAZ': 'qux'}
+
+    def test_get_env_without_lib_dir(self):
+        assert command.get_env() is None
+        base_vars = {'FOO': 'bar'}
+        assert command.get_env(base_vars) is base_vars
+
+    def test_close_terminates_running_process(self):
+        import subprocess
+        python = sys.executable
+        proc = subprocess.Popen([python, '-c', 'import time; time.sleep(30)'])
+        command.close(proc, timeout=0.1)
+        assert proc.returncode is not None
+
+    def test_close_with_exited_process(self):
+        import subprocess
+        python = sys.executable
+        proc = subprocess.Popen([python, '-c', 'pass'])
+        proc.wait()
+        command.close(proc)
+        assert proc.returncode == 0
+
     @skipIf(not on_linux, 'Linux only')
     def test_update_path_var_on_linux(self):
         existing_path_var = '/usr/bin:/usr/local'
@@ -82,6 +202,14 @@ class TestCommand(FileBasedTesting):
         updated_path = command.update_path_var(updated_path, new_path)
         assert updated_path == '/bin/foo\udcb1bar:foo\udcb1bar:/usr/bin:/usr/local'
 
+    def test_update_path_var_with_empty_or_partial_match(self):
+        ps = os.pathsep
+        assert command.update_path_var(None, 'foo') == 'foo'
+        assert command.update_path_var('', 'foo') == 'foo'
+        assert command.update_path_var('foo', None) == 'foo'
+        assert command.update_path_var(f'foobar{ps}bar', 'foo') == f'foo{ps}foobar{ps}bar'
+        assert command.update_path_var(f'bar{ps}foo', 'foo') == f'bar{ps}foo'
+
     @skipIf(not on_mac, 'Mac only')
     def test_update_path_var_on_mac(self):
         existing_path_var = '/usr/bin:/usr/local'
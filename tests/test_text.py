@@ -69,6 +69,11 @@ def test_toascii_works_with_empty_unicode_or_bytes():
     assert text.toascii(u'', translit=True) == u''
 
 
+def test_toascii_with_ascii_unicode_or_bytes():
+    assert text.toascii(b'foo [?] bar\n', translit=False) == u'foo _ bar\n'
+    assert text.toascii(u'foo [?] bar\n', translit=True) == u'foo _ bar\n'
+
+
 def test_python_safe_name():
     s = "not `\\a /`good` -safe name ??"
     assert text.python_safe_name(s) == 'not___a___good___safe_name'